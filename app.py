@@ -1,15 +1,28 @@
 import os
-import requests
 import json
-import pandas as pd
-import io
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from flask import Flask, render_template, request, send_file, flash, redirect, url_for
 
+try:
+    import redis  # 조회 결과 캐시용 (선택 사항)
+except ImportError:
+    redis = None
+
 # --- Flask 앱 생성 ---
 app = Flask(__name__)
 # flash 메시지를 사용하려면 secret_key가 반드시 필요합니다.
 app.config['SECRET_KEY'] = os.urandom(24)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB 파일 업로드 제한
+# 한 번의 요청에서 조회할 수 있는 최대 사업자번호 수 (대량 조회가 워커를 오래 점유하지 않도록 제한)
+MAX_B_NUMBERS = int(os.environ.get("NTS_MAX_BNO", "10000"))
+# API 한 번에 보낼 사업자번호 수 (국세청 API 제한: 100개)
+CHUNK_SIZE = max(1, int(os.environ.get("NTS_CHUNK_SIZE", "100")))
 
 # --- 상태 코드별 안내 문구 (변경 없음) ---
 STATUS_CODE_MESSAGES = {
@@ -20,38 +33,261 @@ STATUS_CODE_MESSAGES = {
     500: "국세청 API 서버에 오류가 발생했습니다. 잠시 후 다시 시도해주세요."
 }
 
+# 사업자번호 입력에서 제거할 문자 (하이픈, 공백류). str.translate 한 번으로 모두 지웁니다.
+_DELETE_TABLE = str.maketrans('', '', '- \t\r\n\u00a0\u3000')
+
+
+def _clean_b_numbers(values):
+    """각 입력값의 앞뒤 공백을 한 번만 제거한 뒤 하이픈/공백을 지우고, 빈 값은 버립니다."""
+    return [s for s in (value.strip().translate(_DELETE_TABLE) for value in values) if s]
+
+
+_B_NO_WEIGHTS = (1, 3, 7, 1, 3, 7, 1, 3, 5)
+INVALID_STATUS = "형식오류"
+
+
+def _valid_bno(b_no: str) -> bool:
+    """사업자등록번호 10자리의 검증번호(마지막 자리)를 확인합니다."""
+    if len(b_no) != 10 or not (b_no.isascii() and b_no.isdigit()):  # 전각/위첨자 숫자 제외
+        return False
+    total = sum(int(b_no[i]) * _B_NO_WEIGHTS[i] for i in range(9)) + (int(b_no[8]) * 5) // 10
+    return (10 - total % 10) % 10 == int(b_no[9])
+
+
+def _invalid_record(b_no: str):
+    # API 응답과 같은 필드로 만들어 화면/엑셀 결과에 그대로 함께 표시합니다.
+    return {"b_no": b_no, "b_stt": INVALID_STATUS, "b_stt_cd": "",
+            "tax_type": "사업자등록번호 형식이 올바르지 않습니다. (국세청 조회 생략)"}
+
+
+# --- 재시도 정책 ---
+# 연결 실패와 일시적인 5xx/429 응답은 최대 3회까지 재시도하고, 그래도 실패하면 마지막 응답을 그대로 돌려받습니다.
+# 응답을 기다리다 시간이 초과된 경우(read)는 재시도하지 않고 바로 서킷 브레이커로 넘깁니다.
+# 서버의 Retry-After는 상한 없이 기다리게 되므로 따르지 않고, 지터를 더한 백오프(최대 backoff_max)만 사용합니다.
+RETRY = Retry(
+    total=3,
+    read=0,
+    backoff_factor=1.0,
+    backoff_jitter=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["POST"]),
+    respect_retry_after_header=False,
+    raise_on_status=False,
+)
+
+
+# --- 공유 HTTP 세션 ---
+# 워커 프로세스당 한 번만 생성되어 keep-alive 연결과 TLS 세션을 재사용합니다.
+POOL_MAXSIZE = 20  # 호스트당 유지할 연결 수 (아래 공유 스레드 풀의 크기와 같음)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=POOL_MAXSIZE, pool_block=False,
+                                     max_retries=RETRY))
+# 응답 압축은 urllib3가 풀 수 있는 형식만 요청합니다. (brotli/zstandard 패키지가 설치되어 있으면 br/zstd도 포함)
+SESSION.headers.update({"Content-Type": "application/json", "Accept": "application/json",
+                        "Accept-Encoding": ACCEPT_ENCODING})
+# 청크 전송용 스레드 풀도 프로세스 전체에서 하나만 사용합니다.
+# 동시에 처리 중인 요청 수와 관계없이 국세청 API로 나가는 동시 호출이 연결 풀 크기를 넘지 않아 연결이 재사용됩니다.
+API_EXECUTOR = ThreadPoolExecutor(max_workers=POOL_MAXSIZE, thread_name_prefix="nts-api")
+# 요청 하나가 동시에 올릴 수 있는 청크 수. 대량 업로드가 공유 풀을 독차지해 다른 요청이 뒤에서 기다리지 않도록 제한합니다.
+REQUEST_MAX_IN_FLIGHT = max(1, POOL_MAXSIZE // 4)
+
+
+# --- 서킷 브레이커 ---
+# 국세청 API가 연속으로 실패하면 일정 시간 동안 호출하지 않고 즉시 오류를 돌려줍니다.
+# 대기 시간이 지나면 다음 호출 하나만 다시 시도되고(half-open), 성공하면 닫히고 실패하면 다시 열립니다.
+# 시험 호출이 결과를 기록하지 못한 채 끝나더라도, 대기 시간이 한 번 더 지나면 새 시험 호출을 허용합니다.
+BREAKER_FAIL_THRESHOLD = 5
+BREAKER_COOL_OFF = 30  # 초
+BREAKER_OPEN_MESSAGE = "일시적으로 조회가 중단되었습니다. 잠시 후 다시 시도해주세요."
+_breaker = {"fails": 0, "opened_at": 0.0, "probe_started_at": None}
+_breaker_lock = threading.Lock()
+
+
+def _breaker_allow_request():
+    with _breaker_lock:
+        if _breaker["fails"] < BREAKER_FAIL_THRESHOLD:
+            return True
+        now = time.monotonic()
+        if now - _breaker["opened_at"] < BREAKER_COOL_OFF:
+            return False
+        probe_started_at = _breaker["probe_started_at"]
+        if probe_started_at is not None and now - probe_started_at < BREAKER_COOL_OFF:
+            return False  # 다른 스레드의 시험 호출이 진행 중입니다.
+        _breaker["probe_started_at"] = now
+        return True
+
+
+def _breaker_record(success: bool):
+    with _breaker_lock:
+        _breaker["probe_started_at"] = None
+        if success:
+            _breaker["fails"] = 0
+        else:
+            _breaker["fails"] += 1
+            _breaker["opened_at"] = time.monotonic()
+
 
-# --- API 호출 함수 (변경 없음) ---
+# --- 조회 결과 캐시 (Redis) ---
+# REDIS_URL이 설정되어 있고 redis 패키지가 설치된 경우에만 사용하며, 없으면 항상 API를 호출합니다.
+# 상태가 확인된 번호는 1시간, 국세청에 등록되지 않은 번호는 등록 가능성을 고려해 5분만 보관합니다.
+CACHE_TTL_OK = 3600
+CACHE_TTL_UNREGISTERED = 300
+REDIS_URL = os.environ.get("REDIS_URL")
+CACHE_TIMEOUT = 0.5  # 초. Redis가 응답하지 않으면 오래 기다리지 않고 API 조회로 넘어갑니다.
+CACHE = (redis.Redis.from_url(REDIS_URL, socket_connect_timeout=CACHE_TIMEOUT, socket_timeout=CACHE_TIMEOUT)
+         if redis is not None and REDIS_URL else None)
+if REDIS_URL and redis is None:
+    print("!!! REDIS_URL이 설정되어 있지만 redis 패키지가 설치되지 않아 조회 결과 캐시를 사용하지 않습니다. (pip install redis)")
+
+
+def _cache_key(b_no: str):
+    return f"bno:v1:{b_no}"
+
+
+def _cache_get_many(business_numbers: list):
+    """캐시에 있는 사업자번호의 조회 결과를 {b_no: 결과} 형태로 반환합니다.
+
+    캐시를 사용하지 않거나 Redis에 접근할 수 없으면 None을 반환합니다.
+    """
+    if CACHE is None or not business_numbers:
+        return None
+    try:
+        values = CACHE.mget([_cache_key(b_no) for b_no in business_numbers])
+    except redis.RedisError as e:
+        print(f"!!! Redis Error: {e}")
+        return None
+    cached = {}
+    for b_no, value in zip(business_numbers, values):
+        if value is None:
+            continue
+        try:
+            cached[b_no] = json.loads(value)
+        except ValueError:
+            continue  # 손상된 캐시 값은 캐시에 없는 것으로 보고 다시 조회합니다.
+    return cached
+
+
+def _cache_set_many(records: list):
+    if CACHE is None or not records:
+        return
+    try:
+        pipe = CACHE.pipeline(transaction=False)
+        for record in records:
+            ttl = CACHE_TTL_OK if record.get("b_stt_cd") else CACHE_TTL_UNREGISTERED
+            pipe.set(_cache_key(record["b_no"]), json.dumps(record, ensure_ascii=False), ex=ttl)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"!!! Redis Error: {e}")
+
+
+# --- API 호출 함수 ---
 def check_business_registration(business_numbers: list, service_key: str):
-    # (이전과 동일한 내용)
     api_url = f"https://api.odcloud.kr/api/nts-businessman/v1/status?serviceKey={service_key}"
     payload = {"b_no": business_numbers}
-    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    if not _breaker_allow_request():
+        return {"error": BREAKER_OPEN_MESSAGE}
     try:
-        response = requests.post(api_url, headers=headers, data=json.dumps(payload), timeout=30)
+        # (연결, 읽기) 타임아웃: 연결 실패는 빨리 감지해 재시도/서킷 브레이커로 넘기고, 응답은 충분히 기다립니다.
+        response = SESSION.post(api_url, json=payload, timeout=(3.05, 27))
         if response.status_code == 200:
-            return response.json()
+            try:
+                data = json.loads(response.content)  # response.text를 거치지 않고 바이트에서 바로 파싱
+            except ValueError as e:
+                _breaker_record(False)
+                print(f"!!! Invalid API Response: {e}")
+                return {"error": f"API 응답을 해석할 수 없습니다. (상세 정보): {e}"}
+            _breaker_record(True)
+            return data
         else:
+            # 4xx는 서버가 정상적으로 응답한 것이므로 성공으로, 5xx는 실패로 기록합니다.
+            _breaker_record(response.status_code < 500)
             error_message = STATUS_CODE_MESSAGES.get(response.status_code,
                                                      f"알 수 없는 오류가 발생했습니다. (상태 코드: {response.status_code})")
-            return {"error": error_message}
+            return {"error": error_message, "http_status": response.status_code}
     except requests.exceptions.RequestException as e:
+        _breaker_record(False)
         detailed_error = str(e)
         print(f"!!! Detailed Network Error: {detailed_error}")
         return {"error": f"네트워크 오류 발생 (상세 정보): {detailed_error}"}
 
 
 # --- 공통 API 호출 로직 ---
+def _unique_preserve_order(items):
+    seen = set()
+    add = seen.add
+    return [x for x in items if not (x in seen or add(x))]
+
+
+def _fetch_chunk(chunk: list, service_key: str):
+    """413(개수 초과) 응답을 받으면 청크를 반으로 나눠 다시 조회합니다.
+
+    나눠서 조회한 경우 실제로 받아들여진 청크 크기를 결과의 "chunk_size"에 담아 돌려줍니다.
+    """
+    api_response = check_business_registration(chunk, service_key)
+    if api_response.get("http_status") != 413 or len(chunk) <= 1:
+        return api_response
+    mid = len(chunk) // 2
+    data = []
+    chunk_size = len(chunk)
+    for half in (chunk[:mid], chunk[mid:]):
+        half_response = _fetch_chunk(half, service_key)
+        if half_response.get("error"):
+            return half_response
+        data.extend(half_response.get("data") or [])
+        chunk_size = min(chunk_size, half_response.get("chunk_size", len(half)))
+    return {"data": data, "chunk_size": chunk_size}
+
+
 def process_api_calls(business_numbers: list, service_key: str):
-    b_number_chunks = [business_numbers[i:i + 100] for i in range(0, len(business_numbers), 100)]
-    all_results = []
-    for chunk in b_number_chunks:
-        api_response = check_business_registration(chunk, service_key)
-        if api_response.get("error"):
-            return None, api_response["error"]  # 결과는 없고, 에러 메시지만 반환
-        if api_response.get("data"):
-            all_results.extend(api_response["data"])
-    return all_results, None  # 결과 반환, 에러 없음
+    # 중복된 번호는 한 번만 조회하고, 결과는 입력 목록(중복 포함) 순서대로 다시 펼쳐서 돌려줍니다.
+    # 검증번호가 맞지 않는 번호는 API로 보내지 않고 "형식오류" 결과로 바로 채웁니다.
+    unique_numbers = _unique_preserve_order(business_numbers)
+    valid_numbers, invalid_numbers = [], []
+    for b_no in unique_numbers:
+        (valid_numbers if _valid_bno(b_no) else invalid_numbers).append(b_no)
+    cached = _cache_get_many(valid_numbers)
+    # 캐시 읽기가 실패했다면 같은 요청에서 쓰기도 시도하지 않습니다. (응답 없는 Redis를 청크마다 기다리지 않도록)
+    cache_available = cached is not None
+    cached = cached or {}
+    misses = [b_no for b_no in valid_numbers if b_no not in cached]
+
+    # 형식오류, 캐시 결과, API 결과를 하나의 b_no -> 결과 맵에 모은 뒤 입력 순서대로 돌려줍니다.
+    by_b_no = {b_no: _invalid_record(b_no) for b_no in invalid_numbers}
+    by_b_no.update(cached)
+    if misses:
+        # 청크별 호출은 네트워크 대기 시간이 대부분이므로 공유 스레드 풀에서 동시에 요청하되,
+        # 요청당 REQUEST_MAX_IN_FLIGHT개까지만 올려 두고 하나가 끝날 때마다 다음 청크를 잘라 올립니다.
+        # 413으로 청크가 나뉘었다면 이 요청의 남은 청크는 받아들여진 크기로 자릅니다.
+        fetched = []
+        chunk_size = CHUNK_SIZE
+        position = 0
+        in_flight = set()
+        try:
+            while True:
+                while position < len(misses) and len(in_flight) < REQUEST_MAX_IN_FLIGHT:
+                    chunk = misses[position:position + chunk_size]
+                    position += len(chunk)
+                    in_flight.add(API_EXECUTOR.submit(_fetch_chunk, chunk, service_key))
+                if not in_flight:
+                    break
+                # 끝나는 순서대로 처리해, 어느 청크든 실패하면 바로 중단하고 성공한 청크는 즉시 맵에 반영합니다.
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    api_response = future.result()
+                    if api_response.get("error"):
+                        return None, api_response["error"]  # 결과는 없고, 에러 메시지만 반환
+                    chunk_size = min(chunk_size, api_response.get("chunk_size", chunk_size))
+                    data = api_response.get("data") or []
+                    by_b_no.update((record["b_no"], record) for record in data)
+                    fetched.extend(data)
+        finally:
+            # 실패 시 아직 시작하지 않은 청크만 취소하고, 이미 전송 중인 청크가 끝나기를 기다리지 않습니다.
+            for future in in_flight:
+                future.cancel()
+        if cache_available:
+            _cache_set_many(fetched)
+
+    return [by_b_no[b_no] for b_no in business_numbers if b_no in by_b_no], None  # 결과 반환, 에러 없음
 
 
 # --- 라우팅 로직 (대규모 수정) ---
@@ -69,12 +305,14 @@ def lookup_direct():
     if not my_service_key:
         return render_template('results.html', error="서버에 서비스 키가 설정되지 않았습니다.")
 
-    b_numbers_raw = request.form.get('business_numbers', '').splitlines()
-    b_numbers = [num.strip().replace('-', '').replace(' ', '') for num in b_numbers_raw if num.strip()]
+    b_numbers = _clean_b_numbers(request.form.get('business_numbers', '').splitlines())
 
     if not b_numbers:
         return render_template('results.html', error="조회할 사업자 번호를 입력해주세요.")
 
+    if len(b_numbers) > MAX_B_NUMBERS:
+        return render_template('results.html', error=f"최대 {MAX_B_NUMBERS}건까지 조회 가능합니다.")
+
     results, error = process_api_calls(b_numbers, my_service_key)
     if error:
         return render_template('results.html', error=f"API 호출 중 오류 발생: {error}")
@@ -100,18 +338,32 @@ def upload_excel():
         return redirect(url_for('index'))
 
     try:
-        df = pd.read_excel(file, engine='openpyxl')
-        if df.empty:
+        # 엑셀 처리 모듈은 업로드가 있을 때만 불러와 워커의 시작 시간과 메모리를 줄입니다.
+        import io
+        from openpyxl import Workbook, load_workbook
+
+        # 첫 번째 열만 필요하므로 전체 시트를 DataFrame으로 읽지 않고 A열만 순서대로 읽습니다.
+        # (첫 행은 제목 행으로 간주해 건너뜁니다.)
+        wb = load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(min_row=2, min_col=1, max_col=1, values_only=True)
+            b_numbers_raw = [str(cell) for (cell,) in rows if cell is not None]
+        finally:
+            wb.close()
+        if not b_numbers_raw:
             flash("엑셀 파일이 비어있습니다.")
             return redirect(url_for('index'))
 
-        b_numbers_raw = df.iloc[:, 0].dropna().astype(str)
-        b_numbers = [num.strip().replace('-', '').replace(' ', '') for num in b_numbers_raw if num.strip()]
+        b_numbers = _clean_b_numbers(b_numbers_raw)
 
         if not b_numbers:
             flash("엑셀 파일의 첫 번째 열에서 유효한 사업자등록번호를 찾을 수 없습니다.")
             return redirect(url_for('index'))
 
+        if len(b_numbers) > MAX_B_NUMBERS:
+            flash(f"최대 {MAX_B_NUMBERS}건까지 조회 가능합니다.")
+            return redirect(url_for('index'))
+
         results, error = process_api_calls(b_numbers, my_service_key)
         if error:
             flash(f"API 호출 중 오류 발생: {error}")
@@ -121,10 +373,15 @@ def upload_excel():
             flash("조회된 결과가 없습니다.")
             return redirect(url_for('index'))
 
-        result_df = pd.DataFrame(results)
+        # 결과 행을 바로 파일 스트림으로 기록하는 write-only 모드로 작성해 메모리를 아낍니다.
+        headers = list(dict.fromkeys(key for row in results for key in row))
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Result')
+        ws.append(headers)
+        for row in results:
+            ws.append([row.get(header) for header in headers])
         output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            result_df.to_excel(writer, index=False, sheet_name='Result')
+        wb.save(output)
         output.seek(0)
 
         return send_file(